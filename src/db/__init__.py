@@ -9,6 +9,9 @@ Modules
 
 Connect 
     Database connectivity 
+
+Query 
+    Cached read-side lookups over census tables 
      
 
 """
\ No newline at end of file
@@ -0,0 +1,233 @@
+#src\db\query.py
+
+"""Query Module
+============
+
+Read-side lookups over the census tables written by the extract pipelines.
+
+Lookups run as bound, parameterised statements against the indexes that ingest_spreadsheet_body creates
+on the `count_` tables, return long or wide pandas DataFrames, and are served from an LRU result cache.
+Lookups only read; they never change the database. Each cache entry carries the
+load id of the load it was read from, taken from the single row `load_` table written alongside the
+counts, so an entry is refreshed as soon as a table is reloaded, even within the same process.
+Tables without a `load_` table are queried but not cached. Question text is joined after the cache, so it
+always reflects the current questions table.
+
+
+Methods
+-------
+
+get_geography_counts(db_path:str, table_name:str, geography_code:str, wide:bool=False, questions_table:str=None):
+    Read the counts for all questions for a given geography —
+    Returns a pandas dataframe
+
+get_question_counts(db_path:str, table_name:str, question_codes:List, wide:bool=True):
+    Read the counts for given questions across all geographies —
+    Returns a pandas dataframe
+
+get_query_metrics():
+    Returns a dictionary of query latency and cache hit-rate metrics
+
+clear_query_cache():
+    Empty the result cache and reset metrics. Returns nothing.
+
+
+History
+-------
+
+20261019 -- Add cached read-side lookups over count tables
+20261019 -- Key the cache on the load id in the load_ table; check indexes in sqlite_master
+20261019 -- Leave index creation to the load; join question text after the cache
+
+"""
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List
+import pandas as pd
+from sqlalchemy import bindparam, text
+from sqlalchemy.exc import DBAPIError
+from src.db.connect import connect_db
+
+CACHE_SIZE = 256
+
+logger = logging.getLogger(__name__)
+
+_connections = dict() # { db_path : connection }
+_cache = OrderedDict() # { key : (load_id, DataFrame) }
+_metrics = {'queries': 0, 'hits': 0, 'misses': 0, 'latency_total': 0.0, 'latency_max': 0.0}
+
+
+# lookups
+
+def get_geography_counts(db_path:str, table_name:str, geography_code:str, wide:bool=False, questions_table:str=None)->pd.DataFrame:
+    """Read the counts for all questions for a given geography —
+    Returns a pandas DataFrame
+
+    Parameters
+    ----------
+    db_path : str
+        Absolute path to database file
+    table_name : str
+        Name given to ingest_spreadsheet_body, without the `count_` prefix.
+    geography_code : str
+        Code of the geography, e.g. '01'.
+    wide : bool
+        Return one row with a column per question code, rather than one row per question.
+    questions_table : str
+        Name of the table written by ingest_spreadsheet_head. Adds question text to long results. Optional.
+
+    Returns
+    -------
+    pandas.DataFrame
+
+    Example
+    -------
+    >>> db_path = 'C:/Users/Public/Documents/test_db.sqlite'
+    >>> northland = get_geography_counts(db_path=db_path, table_name='RegionalCouncil', geography_code='01', questions_table='Questions')
+    >>> print(northland)
+    """
+    _code = f'{table_name.lower()}_code'
+    key = ('geography', db_path, table_name, str(geography_code))
+    def _query(db_conn):
+        sql = f"""SELECT "{_code}", question_code, response_count FROM "count_{table_name}" WHERE "{_code}" = :code;"""
+        long = pd.read_sql(text(sql), db_conn, params={'code': str(geography_code)})
+        long['response_count'] = pd.to_numeric(long['response_count'], errors='coerce')
+        return long
+    long = _get_cached(db_path=db_path, table_name=table_name, key=key, query=_query)
+    if wide:
+        return _set_wide(long, index=_code, columns=_sort_question_codes(long['question_code'].unique()))
+    if questions_table:
+        # joined outside the cache, which is tagged with the load of the counts table only
+        sql = text(
+            f"""SELECT question_code, question_text, question_text2 FROM "{questions_table}" WHERE question_code IN :codes;"""
+        ).bindparams(bindparam('codes', expanding=True))
+        questions = pd.read_sql(sql, _get_connection(db_path=db_path), params={'codes': list(long['question_code'].unique())})
+        long = long.merge(questions, on='question_code', how='left')
+    return long
+
+def get_question_counts(db_path:str, table_name:str, question_codes:List, wide:bool=True)->pd.DataFrame:
+    """Read the counts for given questions across all geographies —
+    Returns a pandas DataFrame
+
+    Parameters
+    ----------
+    db_path : str
+        Absolute path to database file
+    table_name : str
+        Name given to ingest_spreadsheet_body, without the `count_` prefix.
+    question_codes : list
+        Question codes, e.g. ['C', 'D', 'E', 'F'] for the categories of one question. A single code may be given as a str.
+    wide : bool
+        Return one row per geography with a column per question code, rather than one row per count.
+
+    Returns
+    -------
+    pandas.DataFrame
+
+    Example
+    -------
+    >>> db_path = 'C:/Users/Public/Documents/test_db.sqlite'
+    >>> age = get_question_counts(db_path=db_path, table_name='RegionalCouncil', question_codes=['C', 'D', 'E', 'F'])
+    >>> print(age)
+    """
+    _code = f'{table_name.lower()}_code'
+    codes = [question_codes] if isinstance(question_codes, str) else list(question_codes)
+    key = ('question', db_path, table_name, tuple(codes))
+    def _query(db_conn):
+        sql = text(
+            f"""SELECT "{_code}", question_code, response_count FROM "count_{table_name}" WHERE question_code IN :codes;"""
+        ).bindparams(bindparam('codes', expanding=True))
+        long = pd.read_sql(sql, db_conn, params={'codes': codes})
+        long['response_count'] = pd.to_numeric(long['response_count'], errors='coerce')
+        return long
+    long = _get_cached(db_path=db_path, table_name=table_name, key=key, query=_query)
+    if wide:
+        return _set_wide(long, index=_code, columns=codes)
+    return long
+
+
+# metrics
+
+def get_query_metrics()->Dict:
+    """Returns a dictionary of query latency and cache hit-rate metrics
+
+    Returns
+    -------
+    dict
+        { queries, hits, misses, hit_rate, latency_mean_ms, latency_max_ms, cached }
+    """
+    queries = _metrics['queries']
+    return {
+        'queries': queries,
+        'hits': _metrics['hits'],
+        'misses': _metrics['misses'],
+        'hit_rate': _metrics['hits'] / queries if queries else 0.0,
+        'latency_mean_ms': 1000 * _metrics['latency_total'] / queries if queries else 0.0,
+        'latency_max_ms': 1000 * _metrics['latency_max'],
+        'cached': len(_cache),
+    }
+
+def clear_query_cache():
+    """Empty the result cache and reset metrics. Returns nothing. """
+    _cache.clear()
+    for k in _metrics:
+        _metrics[k] = type(_metrics[k])()
+
+
+# helper functions
+
+def _get_connection(db_path:str):
+    """Returns a connection to a given database, reused across lookups"""
+    if db_path not in _connections:
+        _connections[db_path] = connect_db(db_path=db_path)
+    return _connections[db_path]
+
+def _get_load_id(db_conn, table_name:str)->(str | None):
+    """Returns the id of the latest load of a table, from its single row load_ table, otherwise None"""
+    try:
+        return db_conn.execute(text(f"""SELECT load_id FROM "load_{table_name}" LIMIT 1;""")).scalar()
+    except DBAPIError:
+        db_conn.rollback()
+        return None
+
+def _get_cached(db_path:str, table_name:str, key:tuple, query)->pd.DataFrame:
+    """Serve a lookup from the result cache, or run its query when the entry is missing or from an earlier load —
+    Returns a copy of the cached pandas DataFrame
+    """
+    started = time.perf_counter()
+    db_conn = _get_connection(db_path=db_path)
+    load_id = _get_load_id(db_conn, table_name=table_name)
+    entry = _cache.get(key)
+    hit = entry is not None and load_id is not None and entry[0] == load_id
+    if hit:
+        _cache.move_to_end(key)
+        _metrics['hits'] += 1
+        result = entry[1]
+    else:
+        _metrics['misses'] += 1
+        result = query(db_conn)
+        if load_id is None:
+            _cache.pop(key, None)
+        else:
+            _cache[key] = (load_id, result)
+            _cache.move_to_end(key)
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+    elapsed = time.perf_counter() - started
+    _metrics['queries'] += 1
+    _metrics['latency_total'] += elapsed
+    _metrics['latency_max'] = max(_metrics['latency_max'], elapsed)
+    logger.debug(str({'QUERY': key[0], 'TABLE': table_name, 'LOAD': load_id, 'HIT': hit, 'MS': round(1000 * elapsed, 3)}))
+    return result.copy()
+
+def _set_wide(dataframe:pd.DataFrame, index:str, columns:List)->pd.DataFrame:
+    """Returns a long counts dataframe pivoted to one row per geography and one column per question code"""
+    wide = dataframe.pivot(index=index, columns='question_code', values='response_count')
+    wide = wide.reindex(columns=[c for c in columns if c in wide.columns])
+    wide.columns.name = None
+    return wide
+
+def _sort_question_codes(codes:List)->List:
+    """Returns question codes, which are spreadsheet column letters, in spreadsheet order"""
+    return sorted(codes, key=lambda c: (len(str(c)), str(c)))
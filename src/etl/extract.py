@@ -21,11 +21,15 @@ ingest_spreadsheet_range(sheet_name:str, file_path:str, skiprows:int, nrows:int,
     Read a range of cells in a given spreadsheet and write to a given data store. Returns nothing.
 
 ingest_spreadsheet_body(sheet_name:str, file_path:str, skiprows:int, table_name:str, db_path:str): 
-    Read the body of a pivot table with hierachical headers in a given spreadsheet and write to a given data store. Returns nothing.
+    Read the body of a pivot table with hierachical headers in a given spreadsheet and write to a given data store, 
+    together with reconciliation checks computed on the way through and a load record. Returns nothing.
 
 ingest_spreadsheet_head(sheet_name:str, file_path:str, skiprows:int, nrows:int, survey:str, dated:str, section:str, table_name:str, db_path:str='Questions'): 
     Read the body of a pivot table with hierachical headers in a given spreadsheet and write to a given data store. Returns nothing.
 
+ingest_spreadsheet_concordance(sheet_name:str, file_path:str, skiprows:int, column_names:Dict, table_name:str, db_path:str): 
+    Read a geographic concordance table in a given spreadsheet and write to a given data store. Returns nothing.
+
 ingest_access_db : 
     Extract Microsoft Access database tables into a sqlite database —  
     Returns number of database records created.
@@ -34,6 +38,10 @@ _put_dataframe :
     Store dataframes in a sqlite database — 
     Returns number of records created in database for a given dataframe, table name, and database path
 
+_put_count_indexes : 
+    Index a counts table for lookups by geography and by question — 
+    Returns number of indexes created
+
 _get_geospatial_file : 
     Extract a geospatial file — 
     Returns a geopandas geodataframe 
@@ -57,6 +65,16 @@ _set_spreadsheet_body_geog :
     Returns a pandas dataframe
 _set_spreadsheet_body_head : 
     Returns a pandas dataframe
+_set_spreadsheet_body_check : 
+    Compute reconciliation checks for the counts and geographies of a pivot table — 
+    Returns a pandas dataframe
+_get_content_hash : 
+    Returns a hash of the content of a dataframe
+_set_spreadsheet_body_load : 
+    Returns a single row pandas dataframe recording a load
+
+_set_spreadsheet_concordance : 
+    Returns a pandas dataframe
 
 _get_spreadsheet_head : 
     Extract and unpivot hierachical headers of a pivot table — 
@@ -73,24 +91,39 @@ History
 20250429 -- Add pipelines to integrate helper functions in a sequence to extract from source file to a sink data store
 20250430 -- decompose helper functions into _get and _set, pipe with _put in ingest methods.
 20250501 -- Add simple module logging
+20261019 -- Run decorated stages under the profiler when profiling is switched on
+20261019 -- Compute reconciliation checks during ingest_spreadsheet_body and store them as check_ tables
+20261019 -- Add ingest_spreadsheet_concordance
+20261019 -- Record each ingest_spreadsheet_body run with a unique load id in a load_ table
+20261019 -- Index count_ tables for lookups by geography and by question as they are written
 
 """
 import os
 import functools
+import hashlib
+import uuid
 import logging
 import pandas as pd
 import geopandas as gpd
 from openpyxl.utils import get_column_letter 
 from typing import Dict, List
+from sqlalchemy import text
 from sqlalchemy.types import NVARCHAR
 from datetime import datetime, timezone
 from dotenv import load_dotenv
 from src.db.connect import connect_mdb, connect_db 
+from src.etl.profiling import is_profiling, profile_stage
 
 load_dotenv()
 
 PREFIX1 = 'count_'
 PREFIX2 = 'geog_'   
+PREFIX3 = 'check_'
+PREFIX4 = 'conc_'
+PREFIX6 = 'load_' # PREFIX5 is 'rollup_', in the rollup module
+TOTAL_CODE = '00' # geography code given to the total row of a pivot table
+ROUNDING_BASE = 3 # published counts are randomly rounded to multiples of this base
+TOTAL_TOLERANCE = 3 # rounding units allowed between a question sum and its total, scaled by sqrt(geographies)
 
 # Logging setup 
 
@@ -141,7 +174,10 @@ def log_decorator(_func=None):
                 logger_obj.error(str(msg)) 
                 raise 
             try:
-                results = func(*args, **kwargs)
+                if is_profiling(): 
+                    results = profile_stage(func, BATCH_ID, *args, **kwargs)
+                else: 
+                    results = func(*args, **kwargs)
                 return_type = prettify_return_type(str(results.__class__))
                 returns = {'type': return_type }
                 items_returned = list()
@@ -200,13 +236,25 @@ def ingest_spreadsheet_range(sheet_name:str, file_path:str, skiprows:int, nrows:
 def ingest_spreadsheet_body(sheet_name:str, file_path:str, skiprows:int, table_name:str, db_path:str): 
     """Read the body of a pivot table with hierachical headers in a given spreadsheet and write to a given data store. Returns nothing. """
     _body = _get_spreadsheet_body(sheet_name=sheet_name, file_path=file_path, skiprows=skiprows)
-    _body.pipe(_set_spreadsheet_body_count, table_name=table_name).pipe(_put_dataframe, table_name=PREFIX1+table_name, db_path=db_path)
-    _body.pipe(_set_spreadsheet_body_geog, table_name=table_name).pipe(_put_dataframe, table_name=PREFIX2+table_name, db_path=db_path)
+    _count = _body.pipe(_set_spreadsheet_body_count, table_name=table_name)
+    _geog = _body.pipe(_set_spreadsheet_body_geog, table_name=table_name)
+    _count.pipe(_put_dataframe, table_name=PREFIX1+table_name, db_path=db_path)
+    _put_count_indexes(table_name=table_name, db_path=db_path)
+    _geog.pipe(_put_dataframe, table_name=PREFIX2+table_name, db_path=db_path)
+    _check = _set_spreadsheet_body_check(_count, _geog, table_name=table_name)
+    _check.pipe(_put_dataframe, table_name=PREFIX3+table_name, db_path=db_path)
+    _check.pipe(_set_spreadsheet_body_load, table_name=table_name).pipe(_put_dataframe, table_name=PREFIX6+table_name, db_path=db_path)
 
 def ingest_spreadsheet_head(sheet_name:str, file_path:str, skiprows:int, nrows:int, survey:str, dated:str, section:str, table_name:str, db_path:str='Questions'): 
     """Read the body of a pivot table with hierachical headers in a given spreadsheet and write to a given data store. Returns nothing. """
     _head = _get_spreadsheet_head(sheet_name=sheet_name, file_path=file_path, skiprows=skiprows, nrows=nrows)
     _head.pipe(_set_spreadsheet_head, survey=survey, dated=dated, section=section, table_name=table_name).pipe(_put_dataframe, table_name=table_name, db_path=db_path)
+
+
+def ingest_spreadsheet_concordance(sheet_name:str, file_path:str, skiprows:int, column_names:Dict, table_name:str, db_path:str): 
+    """Read a geographic concordance table in a given spreadsheet and write to a given data store. Returns nothing. """
+    _table = _get_spreadsheet_table(sheet_name=sheet_name, file_path=file_path, skiprows=skiprows)
+    _table.pipe(_set_spreadsheet_concordance, column_names=column_names).pipe(_put_dataframe, table_name=PREFIX4+table_name, db_path=db_path)
         
 
 @log_decorator
@@ -294,6 +342,40 @@ def _put_dataframe(dataframe: pd.DataFrame, table_name:str, db_path:str) -> (int
     ) 
 
 
+@log_decorator
+def _put_count_indexes(table_name:str, db_path:str) -> int: 
+    """Index a counts table for lookups by geography and by question — 
+    Returns number of indexes created. 
+
+    _put_dataframe replaces the table on each load, dropping its indexes, so this runs after every load 
+    of a counts table. Readers such as src.db.query rely on these indexes and do not create them. 
+
+    Parameters
+    ----------
+    table_name : str
+        Name given to ingest_spreadsheet_body, without the `count_` prefix. 
+    db_path : str 
+        Absolute path to database file 
+
+    Returns
+    -------
+    int
+        Number of indexes created. 
+    """ 
+    _code = f'{table_name.lower()}_code'
+    _table = PREFIX1 + table_name 
+    indexes = {
+        f'ix_{_table}_geog': f'"{_code}", question_code', 
+        f'ix_{_table}_question': f'question_code, "{_code}"', 
+    }
+    db_conn = connect_db(db_path=db_path)
+    for name, columns in indexes.items(): 
+        db_conn.execute(text(f"""CREATE INDEX IF NOT EXISTS "{name}" ON "{_table}" ({columns});"""))
+    db_conn.commit()
+    db_conn.close()
+    return len(indexes)
+
+
 @log_decorator
 def _get_geospatial_file(file_path:str) -> gpd.GeoDataFrame: 
     """Extract a geospatial file — 
@@ -496,7 +578,7 @@ def _set_spreadsheet_body_geog(dataframe:pd.DataFrame, table_name:str)->pd.DataF
         c = list(dataframe).index(col)
         alpha = get_column_letter( int(c) + 1 ) 
         dataframe.rename(columns={col: alpha}, inplace = True) 
-    dataframe['A'] = dataframe['A'].fillna('00') 
+    dataframe['A'] = dataframe['A'].fillna(TOTAL_CODE) 
     if _name == 'meshblock': 
         dfg = dataframe[['A']] 
         dfg.columns = [f'{_name}_code']
@@ -525,7 +607,7 @@ def _set_spreadsheet_body_count(dataframe:pd.DataFrame, table_name:str)->pd.Data
         c = list(dataframe).index(col)
         alpha = get_column_letter( int(c) + 1 ) 
         dataframe.rename(columns={col: alpha}, inplace = True) 
-    dataframe['A'] = dataframe['A'].fillna('00') 
+    dataframe['A'] = dataframe['A'].fillna(TOTAL_CODE) 
     if _name == 'meshblock': 
         dfc0 = dataframe 
     else: 
@@ -536,6 +618,129 @@ def _set_spreadsheet_body_count(dataframe:pd.DataFrame, table_name:str)->pd.Data
     dfc.columns = [f'{_name}_code', 'question_code', 'response_count'] 
     return dfc  
 
+@log_decorator
+def _set_spreadsheet_body_check(count:pd.DataFrame, geog:pd.DataFrame, table_name:str, tolerance:float=TOTAL_TOLERANCE)->pd.DataFrame: 
+    """Compute reconciliation checks for the counts and geographies of a pivot table — 
+    Returns a long dataframe of checks for the tables written by ingest_spreadsheet_body. 
+
+    The checks are computed from the dataframes in hand, so verifying a load does not need 
+    a second pass over the database. Counts that are not numeric (e.g. confidential cells) are 
+    left out of the sums. The total row, with geography code '00', is left out of the sums and 
+    compared with them instead. 
+
+    Each count is randomly rounded on publication, so a question sum drifts from its total by 
+    rounding errors that add up over the geographies summed. A difference counts as a mismatch 
+    only when it exceeds tolerance * ROUNDING_BASE * sqrt(number of geographies). 
+
+    | check_name | check_key | check_value | 
+    | ---------- | --------- | ----------- | 
+    | row_count | | rows written to the table | 
+    | content_hash | | sha256 of the table content | 
+    | question_sum | question code | sum of counts over geographies | 
+    | geography_sum | geography code | sum of counts over questions | 
+    | question_total | question code | count in the total row of the source sheet | 
+    | question_difference | question code | question_sum less question_total | 
+    | total_tolerance | | largest difference allowed between question_sum and question_total | 
+    | total_mismatch | | number of questions where the difference exceeds total_tolerance | 
+    
+    Parameters
+    ----------
+    count : pandas.DataFrame
+        Counts dataframe returned by _set_spreadsheet_body_count
+    geog : pandas.DataFrame
+        Geographies dataframe returned by _set_spreadsheet_body_geog
+    table_name : str 
+        Name used for the database tables. 
+    tolerance : float 
+        Rounding units allowed between a question sum and its total, before scaling by the number of geographies. 
+
+    Returns
+    -------
+    pandas.DataFrame
+        Enables pipelining
+
+    Example
+    -------
+    >>> chk = _set_spreadsheet_body_check(count, geog, table_name='MeshBlock')
+    >>> print(chk[chk['check_name'] == 'question_difference'])
+    """
+    _code = f'{table_name.lower()}_code'
+    _count_table = PREFIX1 + table_name 
+    _geog_table = PREFIX2 + table_name 
+    responses = pd.to_numeric(count['response_count'], errors='coerce') 
+    is_total = count[_code].astype(str) == TOTAL_CODE 
+    body = responses[~is_total] 
+    question_sum = body.groupby(count.loc[~is_total, 'question_code']).sum().astype('int64') 
+    geography_sum = body.groupby(count.loc[~is_total, _code]).sum().astype('int64') 
+    question_total = responses[is_total].groupby(count.loc[is_total, 'question_code']).sum(min_count=1).dropna().astype('int64') 
+    question_difference = question_sum.reindex(question_total.index, fill_value=0).sub(question_total) 
+    total_tolerance = int(tolerance * ROUNDING_BASE * len(geography_sum) ** 0.5) 
+    total_mismatch = int((question_difference.abs() > total_tolerance).sum()) 
+    checks = [
+        _get_check_rows(_count_table, 'row_count', pd.Series([len(count)])), 
+        _get_check_rows(_count_table, 'content_hash', pd.Series([_get_content_hash(count)])), 
+        _get_check_rows(_count_table, 'question_sum', question_sum), 
+        _get_check_rows(_count_table, 'geography_sum', geography_sum), 
+        _get_check_rows(_count_table, 'question_total', question_total), 
+        _get_check_rows(_count_table, 'question_difference', question_difference), 
+        _get_check_rows(_count_table, 'total_tolerance', pd.Series([total_tolerance])), 
+        _get_check_rows(_count_table, 'total_mismatch', pd.Series([total_mismatch])), 
+        _get_check_rows(_geog_table, 'row_count', pd.Series([len(geog)])), 
+        _get_check_rows(_geog_table, 'content_hash', pd.Series([_get_content_hash(geog)])), 
+    ]
+    if total_mismatch: 
+        logger_obj = get_logger(log_file_name=__name__) 
+        logger_obj.warning(str({'BATCH': BATCH_ID, 'TABLE': _count_table, 'CHECK': 'total_mismatch', 'QUESTIONS': total_mismatch, 'TOLERANCE': total_tolerance})) 
+    checked = pd.concat(checks, ignore_index=True) 
+    checked['batch_id'] = BATCH_ID 
+    return checked 
+
+@log_decorator
+def _set_spreadsheet_body_load(dataframe:pd.DataFrame, table_name:str)->pd.DataFrame: 
+    """Returns a single row dataframe recording a load of the counts table, with an id that is unique to the load 
+
+    Readers compare load_id to tell whether the counts table has been reloaded, even within one process, 
+    where BATCH_ID stays the same. 
+
+    Parameters
+    ----------
+    pandas.DataFrame
+        Checks returned by _set_spreadsheet_body_check
+    table_name : str 
+        Name used for the database tables. 
+
+    Returns
+    -------
+    pandas.DataFrame
+        Enables pipelining
+    """
+    _count_table = PREFIX1 + table_name 
+    checks = dataframe[(dataframe['table_name'] == _count_table) & (dataframe['check_key'] == '')] 
+    values = dict(zip(checks['check_name'], checks['check_value'])) 
+    return pd.DataFrame([{
+        'table_name': _count_table, 
+        'load_id': uuid.uuid4().hex, 
+        'batch_id': BATCH_ID, 
+        'row_count': values.get('row_count'), 
+        'content_hash': values.get('content_hash'), 
+        'loaded_at': datetime.now(timezone.utc).isoformat(), 
+    }])
+
+def _get_check_rows(table_name:str, check_name:str, values:pd.Series)->pd.DataFrame: 
+    """Returns check rows for a series of values keyed by its index. Scalar checks have an empty key. """
+    keys = values.index.astype(str) if values.index.name else [''] * len(values) 
+    return pd.DataFrame({
+        'table_name': table_name, 
+        'check_name': check_name, 
+        'check_key': keys, 
+        'check_value': values.to_numpy(), 
+    })
+
+def _get_content_hash(dataframe:pd.DataFrame)->str: 
+    """Returns a sha256 hex digest of the content of a dataframe, index included, with values hashed as text as they are stored"""
+    hashed = pd.util.hash_pandas_object(dataframe.astype(str), index=True) 
+    return hashlib.sha256(hashed.to_numpy().tobytes()).hexdigest() 
+
 
 @log_decorator
 def _get_spreadsheet_head(sheet_name:str, file_path:str, skiprows:int, nrows:int)->pd.DataFrame: 
@@ -625,6 +830,48 @@ def _set_spreadsheet_head(dataframe:pd.DataFrame, survey:str, dated:str, section
     pvt0['survey_date'] = dated 
     pvt0['survey_section'] = section
     pvt = pvt0.loc[:,['question_code', 'question_text', 'question_text2', 'survey_name', 'survey_date', 'survey_section']]
-    return pvt 
+    return pvt
+
+
+@log_decorator
+def _set_spreadsheet_concordance(dataframe:pd.DataFrame, column_names:Dict)->pd.DataFrame: 
+    """Returns a cleansed concordance dataframe with one row per meshblock and one code column per geography level, 
+    named `<level>_code` with the casing of the level kept for naming rollup tables
+    
+    Parameters
+    ----------
+    pandas.DataFrame
+        Enables pipelining
+    column_names : dict 
+        { source column name : geography level }. One level must be 'meshblock'. 
+        Levels are named as the table_name given to ingest_spreadsheet_body, e.g. 'AreaUnit'. 
+
+    Returns
+    -------
+    pandas.DataFrame
+        Enables pipelining
+
+    Example
+    -------
+    >>> src = _get_spreadsheet_table(
+    ... sheet_name = '2013 Concordance',
+    ... file_path = "C:/Users/Public/Documents/2013-mb-concordance.xlsx",
+    ... skiprows = 0
+    ... )
+    >>> stg = _set_spreadsheet_concordance(
+    ... dataframe = src,
+    ... column_names = {'MB2013': 'MeshBlock', 'AU2013': 'AreaUnit', 'WARD2013': 'Ward', 'TA2013': 'TLA', 'REGC2013': 'RegionalCouncil'}
+    ... )
+    """
+    _names = {k: f'{v}_code' for k, v in column_names.items()}
+    _meshblock = next((v for v in _names.values() if v.lower() == 'meshblock_code'), None)
+    if _meshblock is None: 
+        raise ValueError("column_names must map a source column to 'meshblock'")
+    conc0 = dataframe.loc[:, list(_names)].rename(columns=_names)
+    conc0 = conc0.dropna(subset=[_meshblock])
+    for col in conc0.columns: 
+        conc0[col] = conc0[col].astype('string').str.strip() # keep missing codes as null
+    conc = conc0.drop_duplicates(subset=[_meshblock]).reset_index(drop=True)
+    return conc 
 
     
\ No newline at end of file
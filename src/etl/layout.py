@@ -0,0 +1,231 @@
+#src\etl\layout.py
+
+"""etl
+
+Layout Module
+=============
+
+Detects the layout of the pivot table sheets in a census workbook, so that the `skiprows` and `nrows`
+given to the `ingest_spreadsheet_*` pipelines do not have to be found by hand.
+
+The workbook is opened read-only and only the top-left corner of each sheet is streamed —
+by default the first 50 rows of the first 6 columns. No sheet body is loaded.
+
+Each sheet is described by:
+
+- a title block: leading rows with text in the geography columns only;
+- a header: rows with labels across the data columns, read by `_get_spreadsheet_head`;
+- a body: rows from the first geography code onwards, read by `_get_spreadsheet_body`;
+- geography columns: a code in column A and, except for meshblocks, a description in column B.
+
+
+Methods
+-------
+
+profile_spreadsheet_layout(file_path:str, manifest_path:str=None, max_rows:int=50, max_cols:int=6):
+    Detect the layout of each sheet in a workbook —
+    Returns a list of job manifest entries, one per sheet.
+
+_get_spreadsheet_corner :
+    Stream the top-left corner of a worksheet —
+    Returns a list of rows of cell values
+
+_set_spreadsheet_layout :
+    Detect the title block, header and body of a pivot table from the top-left corner of a sheet —
+    Returns a job manifest entry
+
+
+History
+-------
+
+20261019 -- Add streaming layout detection and job manifests for census workbooks
+20261019 -- Leave head out of the manifest for header depths _set_spreadsheet_head cannot handle
+20261019 -- Check a total row against the body; leave body out where the geography columns disagree with table_name; name head tables per sheet
+
+"""
+import json
+import re
+from typing import Dict, List
+from openpyxl import load_workbook
+from src.etl.extract import log_decorator
+
+CODE_PATTERN = re.compile(r'^\d+$')
+HEAD_DEPTH = 2 # header rows handled by _set_spreadsheet_head
+HEAD_PREFIX = 'Questions' # head tables are named HEAD_PREFIX + table_name, one per sheet
+MESHBLOCK = 'meshblock' # table_name, lower cased, for which ingest_spreadsheet_body expects no description column
+
+
+# pipelines
+
+@log_decorator
+def profile_spreadsheet_layout(file_path:str, manifest_path:str=None, max_rows:int=50, max_cols:int=6)->List:
+    """Detect the layout of each sheet in a workbook —
+    Returns a list of job manifest entries, one per sheet.
+
+    Sheets recognised as pivot tables have kind 'pivot' and carry the keyword arguments for
+    ingest_spreadsheet_head and ingest_spreadsheet_body. Other sheets have kind 'other', with a
+    `reason` where a layout was found but could not be trusted.
+    Where the header is not HEAD_DEPTH rows deep, `head` is None and `head_reason` says why.
+    Where the geography columns found disagree with how ingest_spreadsheet_body treats the
+    table_name, `body` is None and `body_reason` says why.
+
+    Parameters
+    ----------
+    file_path : str
+        Absolute path to the Excel workbook containing the census results.
+    manifest_path : str
+        Absolute path to a json file to write the manifest to. Optional.
+    max_rows : int
+        Number of rows to scan from the top of each sheet.
+    max_cols : int
+        Number of columns to scan from the left of each sheet.
+
+    Returns
+    -------
+    list
+        [ { sheet_name, kind, table_name, title, header_depth, geography, head, head_reason, body, body_reason } ]
+
+    Example
+    -------
+    >>> file_path = "C:/Users/Public/Documents/2013-mb-dataset-Total-New-Zealand-individual-part-1.xlsx"
+    >>> manifest = profile_spreadsheet_layout(file_path=file_path)
+    >>> for job in manifest:
+    ...     if job['kind'] == 'pivot' and job['head'] is not None:
+    ...         ingest_spreadsheet_head(file_path=file_path, survey='Census', dated='2013', section='individual part 1', db_path=db_path, **job['head'])
+    ...     if job['kind'] == 'pivot' and job['body'] is not None:
+    ...         ingest_spreadsheet_body(file_path=file_path, db_path=db_path, **job['body'])
+    """
+    workbook = load_workbook(filename=file_path, read_only=True, data_only=True)
+    try:
+        manifest = [
+            _set_spreadsheet_layout(
+                rows=_get_spreadsheet_corner(worksheet, max_rows=max_rows, max_cols=max_cols),
+                sheet_name=worksheet.title
+            )
+            for worksheet in workbook.worksheets
+        ]
+    finally:
+        workbook.close()
+    if manifest_path:
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump({'file_path': file_path, 'sheets': manifest}, f, indent=2, default=str)
+    return manifest
+
+
+# helper functions
+
+def _get_spreadsheet_corner(worksheet, max_rows:int, max_cols:int)->List:
+    """Stream the top-left corner of a worksheet —
+    Returns a list of rows of cell values, each padded to max_cols, with blank text read as None
+    """
+    rows = list()
+    for row in worksheet.iter_rows(min_row=1, max_row=max_rows, max_col=max_cols, values_only=True):
+        values = [None if isinstance(v, str) and not v.strip() else v for v in row]
+        rows.append(values + [None] * (max_cols - len(values)))
+    return rows
+
+def _set_spreadsheet_layout(rows:List, sheet_name:str)->Dict:
+    """Detect the title block, header and body of a pivot table from the top-left corner of a sheet —
+    Returns a job manifest entry
+
+    Row numbers are zero-based, so they can be given as skiprows.
+
+    Parameters
+    ----------
+    rows : list
+        Rows of cell values returned by _get_spreadsheet_corner
+    sheet_name : str
+        Name of the worksheet
+
+    Returns
+    -------
+    dict
+        Job manifest entry
+    """
+    table_name = re.sub(r'[^0-9A-Za-z]', '', re.sub(r'^\s*\d+\s*', '', sheet_name))
+    layout = {'sheet_name': sheet_name, 'kind': 'other', 'table_name': table_name}
+    body_start = next((r for r, row in enumerate(rows) if _is_code(row[0]) and _has_numbers(row[1:])), None)
+    if body_start is None:
+        return layout
+    has_description = all(isinstance(row[1], str) for row in rows[body_start:] if _is_code(row[0]))
+    data_col = 2 if has_description else 1
+    # a total row with no code, directly above the first code, belongs to the body
+    if body_start > 0:
+        above = rows[body_start - 1]
+        is_candidate = _has_numbers(above[data_col:]) and not _is_years(above[data_col:])
+        if above[0] is None and is_candidate and (not has_description or isinstance(above[1], str)):
+            is_total = _is_total(above, [row for row in rows[body_start:] if _is_code(row[0])], data_col)
+            if is_total is None:
+                layout['reason'] = f'cannot tell whether row {body_start - 1} is a total row or a header row'
+                return layout
+            if is_total:
+                body_start -= 1
+    head_start = body_start
+    while head_start > 0 and any(v is not None for v in rows[head_start - 1][data_col:]):
+        head_start -= 1
+    if head_start == body_start:
+        return layout
+    title = [str(row[0]).strip() for row in rows[:head_start] if row[0] is not None]
+    header_depth = body_start - head_start
+    head, head_reason = None, None
+    if header_depth == HEAD_DEPTH:
+        head = {'sheet_name': sheet_name, 'skiprows': head_start, 'nrows': header_depth, 'table_name': HEAD_PREFIX + table_name}
+    else:
+        head_reason = f'header is {header_depth} rows deep; ingest_spreadsheet_head reads {HEAD_DEPTH}'
+    body, body_reason = None, None
+    if has_description == (table_name.lower() == MESHBLOCK):
+        body_reason = (
+            f"description column found, but ingest_spreadsheet_body reads column B as counts for '{table_name}'"
+            if has_description else
+            f"no description column found, but ingest_spreadsheet_body drops column B for '{table_name}'"
+        )
+    else:
+        body = {'sheet_name': sheet_name, 'skiprows': body_start, 'table_name': table_name}
+    layout.update({
+        'kind': 'pivot',
+        'title': title,
+        'header_depth': header_depth,
+        'geography': {'code_column': 'A', 'description_column': 'B' if has_description else None},
+        'head': head,
+        'head_reason': head_reason,
+        'body': body,
+        'body_reason': body_reason,
+    })
+    return layout
+
+def _is_code(value)->bool:
+    """Returns True if a cell value looks like a geography code"""
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return True
+    return isinstance(value, str) and CODE_PATTERN.match(value.strip()) is not None
+
+def _is_total(row:List, body:List, data_col:int)->(bool | None):
+    """Returns True if a row is at least as large as every body row in each data column, as a total row is,
+    False if it is smaller in any column, or None where no column has numbers to compare
+    """
+    compared = False
+    for c in range(data_col, len(row)):
+        if not _is_number(row[c]):
+            continue
+        column = [r[c] for r in body if _is_number(r[c])]
+        if not column:
+            continue
+        if row[c] < max(column):
+            return False
+        compared = True
+    return True if compared else None
+
+def _is_number(value)->bool:
+    """Returns True if a cell value is a number"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _is_years(values:List)->bool:
+    """Returns True if every number in a row of cell values looks like a census year, as in a header row"""
+    numbers = [v for v in values if _is_number(v)]
+    return bool(numbers) and all(float(v).is_integer() and 1800 <= v <= 2100 for v in numbers)
+
+def _has_numbers(values:List)->bool:
+    """Returns True if any cell value is a number"""
+    return any(_is_number(v) for v in values)
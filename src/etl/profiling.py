@@ -0,0 +1,235 @@
+#src\etl\profiling.py
+
+"""etl
+
+Profiling Module
+================
+
+Opt-in profiling of the extract stages decorated with `log_decorator`.
+
+Profiling is off by default. It is switched on either by setting `PROFILE=1` in the `.env` file,
+or at runtime by calling `enable_profiling`. When it is off, a decorated stage pays for one flag check.
+
+When it is on, each decorated stage is run under:
+
+- a sampling CPU profiler that records call stacks in the folded (collapsed) stack format
+  read by flamegraph.pl, speedscope and inferno; and
+- tracemalloc, reporting the top-N allocation sites by size.
+
+Results are written per batch next to the log files:
+
+```
+    LOGDIR/
+    ├── src_etl_extract.log
+    └── <BATCH_ID>/
+        ├── 0001__get_spreadsheet_body.folded
+        └── 0001__get_spreadsheet_body.alloc.txt
+```
+
+
+Methods
+-------
+
+enable_profiling(profile_dir:str=None, top_n:int=None, interval:float=None):
+    Switch profiling on for subsequent stages. Returns nothing.
+
+disable_profiling():
+    Switch profiling off for subsequent stages. Returns nothing.
+
+is_profiling():
+    Returns True if profiling is switched on.
+
+profile_stage(func, batch_id:int, *args, **kwargs):
+    Run a stage under the CPU and allocation profilers and write the results —
+    Returns the result of the stage.
+
+_StackSampler :
+    Sample the call stacks of a running stage from a background thread
+
+
+History
+-------
+
+20261019 -- Add opt-in per-stage CPU and allocation profiling
+
+"""
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Profiling setup
+
+PROFILE = os.getenv('PROFILE', '').strip().lower() in ('1', 'true', 'yes', 'on')
+PROFILEDIR = os.getenv('PROFILEDIR') or os.getenv('LOGDIR') or ''
+PROFILE_TOP_N = int(os.getenv('PROFILE_TOP_N') or 10)
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL') or 0.005)
+
+_settings = {
+    'enabled': PROFILE,
+    'profile_dir': PROFILEDIR,
+    'top_n': PROFILE_TOP_N,
+    'interval': PROFILE_INTERVAL,
+}
+_state = {'active': False, 'sequence': 0}
+
+
+def enable_profiling(profile_dir:str=None, top_n:int=None, interval:float=None):
+    """Switch profiling on for subsequent stages. Returns nothing.
+
+    Parameters
+    ----------
+    profile_dir : str
+        Directory under which a folder per batch is created. Defaults to `PROFILEDIR`, then `LOGDIR`.
+    top_n : int
+        Number of allocation sites to report per stage.
+    interval : float
+        Seconds between stack samples.
+
+    Example
+    -------
+    >>> from src.etl.profiling import enable_profiling, disable_profiling
+    >>> enable_profiling(top_n=20)
+    >>> ingest_spreadsheet_body(...)
+    >>> disable_profiling()
+    """
+    if profile_dir is not None:
+        _settings['profile_dir'] = profile_dir
+    if top_n is not None:
+        _settings['top_n'] = int(top_n)
+    if interval is not None:
+        _settings['interval'] = float(interval)
+    _settings['enabled'] = True
+
+def disable_profiling():
+    """Switch profiling off for subsequent stages. Returns nothing. """
+    _settings['enabled'] = False
+
+def is_profiling() -> bool:
+    """Returns True if profiling is switched on. """
+    return _settings['enabled']
+
+
+class _StackSampler(threading.Thread):
+    """Sample the call stacks of a running stage from a background thread
+
+    Stacks are rooted at the frame of the profiled stage and counted per unique stack,
+    so that each line of output reads `outer;inner;innermost count`.
+    """
+    def __init__(self, thread_id:int, root_code, interval:float):
+        super().__init__(name='stage-profiler', daemon=True)
+        self.thread_id = thread_id
+        self.root_code = root_code
+        self.interval = interval
+        self.stacks = dict()
+        self._halt = threading.Event()
+
+    def run(self):
+        while not self._halt.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = list()
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                if frame.f_code is self.root_code:
+                    break
+                frame = frame.f_back
+            else:
+                continue # stage frame not on the stack yet, or already returned
+            key = ';'.join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def stop(self):
+        self._halt.set()
+        self.join()
+
+
+def _frame_label(frame) -> str:
+    """Returns a `module.function:line` label for a frame, safe for the folded stack format"""
+    code = frame.f_code
+    module = frame.f_globals.get('__name__', '?')
+    name = getattr(code, 'co_qualname', code.co_name)
+    return f"{module}.{name}:{code.co_firstlineno}".replace(';', ',').replace(' ', '_')
+
+
+def profile_stage(func, batch_id:int, *args, **kwargs):
+    """Run a stage under the CPU and allocation profilers and write the results —
+    Returns the result of the stage.
+
+    Stages called from within a profiled stage are not profiled separately;
+    they appear in the stacks and allocations of the enclosing stage.
+    Failures to write the profile are logged, not raised.
+
+    Parameters
+    ----------
+    func : callable
+        The undecorated stage function.
+    batch_id : int
+        Batch identifier used to name the output folder.
+
+    Returns
+    -------
+    object
+        Whatever the stage returns.
+    """
+    if _state['active']:
+        return func(*args, **kwargs)
+    _state['active'] = True
+    _state['sequence'] += 1
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    sampler = _StackSampler(
+        thread_id=threading.get_ident(),
+        root_code=func.__code__,
+        interval=_settings['interval']
+    )
+    started = time.perf_counter()
+    sampler.start()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        sampler.stop()
+        elapsed = time.perf_counter() - started
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if started_tracing:
+            tracemalloc.stop()
+        _state['active'] = False
+        try:
+            _put_profile(
+                func_name=func.__name__,
+                batch_id=batch_id,
+                stacks=sampler.stacks,
+                snapshot=snapshot,
+                elapsed=elapsed,
+                peak=peak
+            )
+        except Exception as e: # a failed profile must not fail the stage
+            from src.etl.extract import get_logger # imported here, as extract imports this module
+            logger_obj = get_logger(log_file_name='src.etl.extract')
+            logger_obj.error(str({'BATCH': batch_id, 'FUNCTION': func.__name__, 'PROFILE_ERROR': e}))
+
+
+def _put_profile(func_name:str, batch_id:int, stacks:dict, snapshot, elapsed:float, peak:int):
+    """Write the folded stacks and the top-N allocation report for a stage. Returns nothing. """
+    profile_path = os.path.join(_settings['profile_dir'], str(batch_id))
+    os.makedirs(profile_path, exist_ok=True)
+    file_stem = os.path.join(profile_path, f"{_state['sequence']:04d}_{func_name}")
+    with open(file_stem + '.folded', 'w', encoding='utf-8') as f:
+        for stack, count in sorted(stacks.items()):
+            f.write(f"{stack} {count}\n")
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, threading.__file__),
+    ))
+    with open(file_stem + '.alloc.txt', 'w', encoding='utf-8') as f:
+        f.write(f"BATCH: {batch_id}\nFUNCTION: {func_name}\n")
+        f.write(f"ELAPSED: {elapsed:.6f} s\nSAMPLES: {sum(stacks.values())}\nPEAK: {peak} B\n\n")
+        for stat in snapshot.statistics('lineno')[:_settings['top_n']]:
+            f.write(f"{stat}\n")
@@ -0,0 +1,216 @@
+#src\etl\rollup.py
+
+"""etl
+
+Rollup Module
+=============
+
+Aggregates meshblock counts into every higher geography level of a concordance.
+
+The concordance table written by `ingest_spreadsheet_concordance` is turned into compact integer
+mapping arrays: one array per geography level, giving for each meshblock the position of its parent
+in that level. The `count_meshblock` table is read once, its text codes are converted to integer
+positions, and each level is summed with a single vectorised `numpy.bincount`. The results are
+materialised as `rollup_<table_name>_<concordance_table>_<Level>` tables, shaped like the `count_<Level>`
+tables, so that they are not recomputed on every query.
+
+
+Methods
+-------
+
+rollup_count_meshblock(concordance_table:str, db_path:str, table_name:str='MeshBlock'):
+    Aggregate meshblock counts into each geography level of a concordance and write to a given data store —
+    Returns dictionary of number of rows inserted per table.
+
+_get_dataframe :
+    Read a table from a sqlite database —
+    Returns a pandas dataframe
+
+_get_concordance_mapping :
+    Build integer mapping arrays from a concordance —
+    Returns a dictionary of (parent positions, level codes) per geography level
+
+_set_rollup :
+    Aggregate meshblock counts into each geography level of a mapping —
+    Returns a dictionary of pandas dataframes per geography level
+
+
+History
+-------
+
+20261019 -- Add concordance mapping arrays and vectorised rollup of meshblock counts
+20261019 -- Name rollup tables after their source tables; log meshblocks missing from the concordance
+20261019 -- Read the code column named after table_name from the counts table
+
+"""
+import numpy as np
+import pandas as pd
+from typing import Dict, Tuple
+from sqlalchemy import text
+from src.db.connect import connect_db
+from src.etl.extract import PREFIX1, PREFIX4, TOTAL_CODE, BATCH_ID, get_logger, log_decorator, _put_dataframe
+
+PREFIX5 = 'rollup_'
+BASE_LEVEL = 'meshblock'
+
+
+# pandas pipelines
+
+@log_decorator
+def rollup_count_meshblock(concordance_table:str, db_path:str, table_name:str='MeshBlock')->Dict:
+    """Aggregate meshblock counts into each geography level of a concordance and write to a given data store —
+    Returns dictionary of number of rows inserted per table.
+
+    Counts that are not numeric (e.g. confidential cells) and meshblocks missing from the concordance,
+    including the total row, are left out of the sums. A warning is logged with the number of
+    meshblock codes, other than the total row, that are missing from the concordance.
+
+    Each level is written to `rollup_<table_name>_<concordance_table>_<Level>`,
+    e.g. `rollup_MeshBlock_2013_AreaUnit`.
+
+    Parameters
+    ----------
+    concordance_table : str
+        Name given to ingest_spreadsheet_concordance, without the `conc_` prefix.
+    db_path : str
+        Absolute path to database file
+    table_name : str
+        Name given to ingest_spreadsheet_body for the meshblock sheet, without the `count_` prefix.
+        Its code column, `<table_name>_code` in lower case, must hold meshblock codes.
+
+    Returns
+    -------
+    dict
+        { table name : row count }
+
+    Example
+    -------
+    >>> ingest_spreadsheet_concordance(
+    ... sheet_name = '2013 Concordance',
+    ... file_path = "C:/Users/Public/Documents/2013-mb-concordance.xlsx",
+    ... skiprows = 0,
+    ... column_names = {'MB2013': 'MeshBlock', 'AU2013': 'AreaUnit', 'WARD2013': 'Ward', 'TA2013': 'TLA', 'REGC2013': 'RegionalCouncil'},
+    ... table_name = '2013',
+    ... db_path = 'C:/Users/Public/Documents/test_db.sqlite'
+    ... )
+    >>> result = rollup_count_meshblock(concordance_table='2013', db_path='C:/Users/Public/Documents/test_db.sqlite')
+    >>> [print(k,v) for k,v in result.items()]
+    """
+    _concordance = _get_dataframe(table_name=PREFIX4+concordance_table, db_path=db_path)
+    _count = _get_dataframe(table_name=PREFIX1+table_name, db_path=db_path)
+    _mapping = _get_concordance_mapping(_concordance)
+    _rollup = _set_rollup(_count, _mapping, table_name=table_name)
+    results = dict()
+    for level, dataframe in _rollup.items():
+        _table = f'{PREFIX5}{table_name}_{concordance_table}_{level}'
+        results[_table] = _put_dataframe(dataframe, table_name=_table, db_path=db_path)
+    return results
+
+
+# helper functions
+
+@log_decorator
+def _get_dataframe(table_name:str, db_path:str)->pd.DataFrame:
+    """Read a table from a sqlite database —
+    Returns a pandas DataFrame for a table written by _put_dataframe
+
+    Parameters
+    ----------
+    table_name : str
+        Name of the table to be read.
+    db_path : str
+        Absolute path to database file
+
+    Returns
+    -------
+    pandas.DataFrame
+        Enables pipelining
+    """
+    db_conn = connect_db(db_path=db_path)
+    return pd.read_sql(text(f"""SELECT * FROM "{table_name}";"""), db_conn, index_col='_id')
+
+
+def _get_concordance_mapping(dataframe:pd.DataFrame)->Dict[str, Tuple[np.ndarray, pd.Index]]:
+    """Build integer mapping arrays from a concordance —
+    Returns a dictionary of (parent positions, level codes) per geography level
+
+    For every level, `parent positions` is an int32 array aligned to the meshblock codes,
+    holding the position of each meshblock's parent in `level codes`, or -1 where it has none.
+    The meshblock level maps onto itself, under the key BASE_LEVEL. Other levels keep the casing
+    of their concordance columns, e.g. 'AreaUnit'.
+
+    Parameters
+    ----------
+    dataframe : pandas.DataFrame
+        Concordance written by ingest_spreadsheet_concordance
+
+    Returns
+    -------
+    dict
+        { level : (numpy.ndarray, pandas.Index) }
+    """
+    _base = next(col for col in dataframe.columns if col.lower() == f'{BASE_LEVEL}_code')
+    meshblock = pd.Index(dataframe[_base].astype(str).str.strip())
+    mapping = {BASE_LEVEL: (np.arange(len(meshblock), dtype=np.int32), meshblock)}
+    for col in dataframe.columns:
+        if not col.endswith('_code') or col == _base:
+            continue
+        codes, labels = pd.factorize(dataframe[col].str.strip(), sort=True)
+        mapping[col[:-len('_code')]] = (codes.astype(np.int32), pd.Index(labels))
+    return mapping
+
+
+def _set_rollup(dataframe:pd.DataFrame, mapping:Dict, table_name:str='MeshBlock')->Dict[str, pd.DataFrame]:
+    """Aggregate meshblock counts into each geography level of a mapping —
+    Returns a dictionary of long counts dataframes per geography level, shaped like the count_ tables
+
+    Logs a warning with the number of meshblock codes, other than the total row, that are not in the
+    mapping, e.g. because the concordance stored codes as numbers without their leading zeros.
+
+    Parameters
+    ----------
+    dataframe : pandas.DataFrame
+        Meshblock counts written by ingest_spreadsheet_body
+    mapping : dict
+        Mapping arrays returned by _get_concordance_mapping
+    table_name : str
+        Name of the meshblock counts table, without the `count_` prefix. Names its code column.
+
+    Returns
+    -------
+    dict
+        { level : pandas.DataFrame }
+    """
+    _code = f'{table_name.lower()}_code'
+    if _code not in dataframe.columns:
+        raise ValueError(f"{PREFIX1+table_name} has no {_code} column; table_name must be the name given to ingest_spreadsheet_body")
+    codes = dataframe[_code].astype(str).str.strip()
+    meshblock = mapping[BASE_LEVEL][1].get_indexer(codes)
+    unmatched = codes[(meshblock < 0) & (codes != TOTAL_CODE)].unique()
+    if len(unmatched):
+        logger_obj = get_logger(log_file_name='src.etl.extract')
+        logger_obj.warning(str({
+            'BATCH': BATCH_ID, 'TABLE': PREFIX1+table_name, 'CHECK': 'unmatched_meshblock',
+            'MESHBLOCKS': len(unmatched), 'EXAMPLES': list(unmatched[:5])
+        }))
+    question, questions = pd.factorize(dataframe['question_code'], sort=True)
+    responses = pd.to_numeric(dataframe['response_count'], errors='coerce').to_numpy(dtype='float64')
+    keep = (meshblock >= 0) & (question >= 0) & ~np.isnan(responses)
+    meshblock, question, responses = meshblock[keep], question[keep].astype(np.int64), responses[keep]
+    n_questions = len(questions)
+    rolled = dict()
+    for level, (parents, labels) in mapping.items():
+        if level == BASE_LEVEL:
+            continue
+        parent = parents[meshblock]
+        has_parent = parent >= 0
+        key = parent[has_parent].astype(np.int64) * n_questions + question[has_parent]
+        size = len(labels) * n_questions
+        sums = np.bincount(key, weights=responses[has_parent], minlength=size)
+        cells = np.flatnonzero(np.bincount(key, minlength=size))
+        rolled[level] = pd.DataFrame({
+            f'{level.lower()}_code': labels[cells // n_questions],
+            'question_code': questions[cells % n_questions],
+            'response_count': np.rint(sums[cells]).astype(np.int64),
+        })
+    return rolled
@@ -0,0 +1,64 @@
+#tests\test_layout.py
+
+"""Tests for the layout module
+
+Each case gives the top-left corner of a sheet as rows of cell values, as read by _get_spreadsheet_corner.
+
+"""
+from src.etl.layout import _set_spreadsheet_layout
+
+
+def test_regional_council_sheet():
+    rows = [
+        ['Table 5', None, None, None],
+        [None, None, 'age in broad groups', None],
+        [None, None, 'Under 15 years', '15-64 years'],
+        [None, 'Total New Zealand', 100, 200],
+        ['01', 'Northland Region', 40, 90],
+        ['02', 'Auckland Region', 60, 110],
+    ]
+    layout = _set_spreadsheet_layout(rows, sheet_name='5 Regional Council Area')
+    assert layout['kind'] == 'pivot'
+    assert layout['head'] == {'sheet_name': '5 Regional Council Area', 'skiprows': 1, 'nrows': 2, 'table_name': 'QuestionsRegionalCouncilArea'}
+    assert layout['body'] == {'sheet_name': '5 Regional Council Area', 'skiprows': 3, 'table_name': 'RegionalCouncilArea'}
+
+
+def test_numeric_header_is_not_a_total_row():
+    rows = [
+        ['Table 7', None, None, None, None],
+        [None, 'number of children', None, None, None],
+        [None, 0, 1, 2, 3],
+        ['0000100', 12, 6, 9, 3],
+        ['0000200', 15, 3, 6, 0],
+    ]
+    layout = _set_spreadsheet_layout(rows, sheet_name='1 Meshblock')
+    assert layout['kind'] == 'pivot'
+    assert layout['header_depth'] == 2
+    assert layout['head']['skiprows'] == 1
+    assert layout['body']['skiprows'] == 3
+
+
+def test_undecidable_total_row_is_refused():
+    rows = [
+        ['Table 7', None, None],
+        [None, 'number of children', None],
+        [None, None, 4],
+        ['0000100', 3, '..'],
+        ['0000200', 6, 'C'],
+    ]
+    layout = _set_spreadsheet_layout(rows, sheet_name='1 Meshblock')
+    assert layout['kind'] == 'other'
+    assert 'row 2' in layout['reason']
+
+
+def test_meshblock_sheet_under_another_name_has_no_body():
+    rows = [
+        ['Table 1', None, None],
+        [None, 'age', None],
+        [None, 'Under 15 years', '15-64 years'],
+        ['0000100', 6, 9],
+    ]
+    layout = _set_spreadsheet_layout(rows, sheet_name='1 Meshblock 2013')
+    assert layout['geography']['description_column'] is None
+    assert layout['body'] is None
+    assert 'column B' in layout['body_reason']